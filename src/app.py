@@ -1,15 +1,21 @@
-from functools import lru_cache
+from functools import lru_cache, wraps
 import os
 
 from chalice import Chalice
 from doglessdata import DataDogMetrics
-import boto3
 
-from chalicelib import controller
+from chalicelib import controller, profiling
+from chalicelib.document import Document
 
 app = Chalice(app_name="888")
 
 THIS = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "bet-dev")
+BETS_STREAM_ARN = os.environ.get("BETS_STREAM_ARN")
+SWAGGER_PATH = os.path.join(
+    os.path.dirname(__file__), "chalicelib", "swagger.json"
+)
+PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+STREAM_BATCH_SIZE = 10  # changes per stream handler call, paced writes
 metrics = DataDogMetrics()
 
 
@@ -21,6 +27,47 @@ def is_dev():
         return False
 
 
+def profile_requested():
+    """
+    Profiling asked by `?_profile=1` or `X-Profile: 1`, only honoured in dev.
+    """
+    request = app.current_request
+    if not is_dev() or request is None:
+        return False
+    flag = (request.query_params or {}).get("_profile")
+    flag = flag or request.headers.get("x-profile")
+    return flag in ("1", "true")
+
+
+def profiled(view_function):
+    """
+    Runs {view_function} under a profiler when requested in dev, returning
+    the summary instead of the response, or on 1 of `PROFILE_SAMPLE_RATE`
+    requests, shipping the summary as metrics.
+    """
+
+    @wraps(view_function)
+    def wrapper(*args, **kwargs):
+        requested = profile_requested()
+        if not requested and not profiling.sampled(PROFILE_SAMPLE_RATE):
+            return view_function(*args, **kwargs)
+
+        response, profiler, gathered = profiling.profile(
+            view_function, *args, **kwargs
+        )
+        summary = profiling.summarize(profiler, gathered)
+        summary["route"] = view_function.__name__
+        app.log.info("profile: %s", summary)
+        if requested:
+            return {"profile": summary}
+        tags = ["route:%s" % view_function.__name__]
+        for category, seconds in summary["categories"].items():
+            metrics.histogram("bets.profile.%s" % category, seconds, tags=tags)
+        return response
+
+    return wrapper
+
+
 if is_dev():
     app.debug = True
 
@@ -64,45 +111,49 @@ if is_dev():
 
 @app.route("/")
 @metrics.timeit
-@lru_cache()
+@profiled
 def get_root():
     """
     Describes available endpoints.
     """
-    if app.current_request is None:
-        context = {}
-    else:
-        context = app.current_request.context
-    api_id = context.get("apiId")
-    stage = context.get("stage")
-    if api_id and stage:
-        ag = boto3.client("apigateway")
-        response = (
-            ag.get_export(restApiId=api_id, stageName=stage, exportType="swagger",)[
-                "body"
-            ]
-            .read()
-            .decode()
-        )
-        return response
+    request = app.current_request
+    context = request.context if request else {}
+    if context.get("apiId") and os.path.exists(SWAGGER_PATH):
+        document = get_swagger_document()
     else:
-        endpoints = []
-        for path in app.routes.values():
-            for handler in path.values():
-                url = "%s %s" % (handler.method, handler.uri_pattern)
-                description = handler.view_function.__doc__
-                doc_item = {"url": url, "description": description}
-                endpoints.append(doc_item)
-        response = {
-            "service": "basic betting management API",
-            "api": THIS,
-            "endpoints": endpoints,
-        }
-        return response
+        document = get_endpoints_document()
+    headers = request.headers if request else {}
+    return document.response(headers)
+
+
+@lru_cache()
+def get_swagger_document():
+    """
+    Swagger description generated at package time, see `make swagger`.
+    """
+    return Document.from_file(SWAGGER_PATH)
+
+
+@lru_cache()
+def get_endpoints_document():
+    endpoints = []
+    for path in app.routes.values():
+        for handler in path.values():
+            url = "%s %s" % (handler.method, handler.uri_pattern)
+            description = handler.view_function.__doc__
+            doc_item = {"url": url, "description": description}
+            endpoints.append(doc_item)
+    response = {
+        "service": "basic betting management API",
+        "api": THIS,
+        "endpoints": endpoints,
+    }
+    return Document(response)
 
 
 @app.route("/match/{match_id}")
 @metrics.timeit
+@profiled
 def get_match_by_id(match_id):
     """
     Fetches details for match {id}.
@@ -128,11 +179,37 @@ def get_match_by_id(match_id):
     return controller.get_match_by_id(match_id)
 
 
+@app.route("/match/{match_id}/odds-history")
+@metrics.timeit
+@profiled
+def get_odds_history(match_id):
+    """
+    Odds history of match {id}, downsampled to one point per window.
+    Options:
+        resolution=[seconds] (default 60)
+        from=[epoch seconds] (default 24 hours before `to`)
+        to=[epoch seconds] (default now), at most 7 days after `from`
+
+    response = {
+        "id": match_id,
+        "resolution": 60,
+        "selections": [
+            {"id": 8243901714083343000, "odds": [[1529490600, 1.01], ...]},
+            {"id": 5737666888266680000, "odds": [[1529490600, 1.01], ...]},
+        ],
+    }
+    """
+    query_params = app.current_request.query_params or {}
+    response = controller.get_odds_history(match_id, query_params)
+    return response
+
+
 @app.route("/matches")
 @metrics.timeit
+@profiled
 def get_matches():
     """
-    Searchs matches in {sport}.
+    Searchs matches in {sport} (case insensitive).
     Options:
         ordening=[startTime]
 
@@ -165,14 +242,66 @@ def get_matches():
         "startTime": "2018-06-20 10:30:00"
       }
     ]
+
+    Matches past the active fixture window are only listed with:
+        include_archived=[1|true]
+        archived_from=[YYYY-MM-DD]&archived_to=[YYYY-MM-DD] (31 days at most)
+
+    Matches of a team or player, by selection name or id:
+        `GET https://domain/api/matches?selection=Real%20Madrid`
+        `GET https://domain/api/matches?selection=8243901714083343527`
     """
     query_params = app.current_request.query_params
     response = controller.get_matches(query_params)
     return response
 
 
+@app.route("/matches/suggest")
+@metrics.timeit
+@profiled
+def get_suggestions():
+    """
+    Autocompletes match and team names, latest matches first.
+    Options:
+        limit=[1-50] (default 10)
+
+    e.g.:
+        `GET https://domain/api/matches/suggest?q=real%20ma`
+
+    [
+      {"kind": "selection", "id": {id}, "name": "Real Madrid"},
+      {"kind": "match", "id": {id}, "name": "Real Madrid vs Barcelona"}
+    ]
+    """
+    query_params = app.current_request.query_params or {}
+    response = controller.get_suggestions(query_params)
+    return response
+
+
+@app.route("/sports")
+@metrics.timeit
+@profiled
+def get_sports():
+    """
+    Lists sports and their markets with the count of unarchived events:
+    upcoming ones and those started less than a week ago.
+
+    [
+      {
+        "id": 221,
+        "name": "Football",
+        "unarchived_events": 12,
+        "markets": [{"name": "Winner", "unarchived_events": 12}]
+      }
+    ]
+    """
+    response = controller.get_sports()
+    return response
+
+
 @app.route("/message", methods=["PUT"], content_types=["application/json"])
 @metrics.timeit
+@profiled
 def put_message():
     """
     `PUT https://domain/api/message`
@@ -184,6 +313,7 @@ def put_message():
 
 @app.route("/message", methods=["POST"], content_types=["application/json"])
 @metrics.timeit
+@profiled
 def post_message():
     """
     `POST https://domain/api/message`
@@ -223,3 +353,18 @@ def post_message():
     payload = app.current_request.raw_body
     result = controller.post_message(payload)
     return result
+
+
+if BETS_STREAM_ARN:
+
+    @app.on_dynamodb_record(
+        stream_arn=BETS_STREAM_ARN, batch_size=STREAM_BATCH_SIZE
+    )
+    def process_stream(event):
+        """
+        Writes the indexes, odds history and counters of the betting table
+        changes, archives the events expired (TTL) from it.
+        """
+        records = [record.to_dict() for record in event]
+        result = controller.process_stream(records)
+        return result
@@ -0,0 +1,284 @@
+"""
+Bulk export/import of DynamoDB tables as gzipped NDJSON snapshots.
+
+    python bulk.py export betting-table-dev ../_dump/dev --segments 8
+    python bulk.py import betting-table-staging ../_dump/dev --workers 8
+    python bulk.py normalize betting-table-dev --segments 8
+
+Items are kept in DynamoDB JSON, so numbers and types round trip exactly.
+Exports are split in one file per scan segment, listed in a manifest;
+imports write the listed files in batches, checkpointing the lines done per
+file so an interrupted import resumes where it stopped. Normalize backfills
+the `_sport` lookup key of events stored before sport names were normalized.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import gzip
+import json
+import os
+import threading
+
+from chalicelib.executor import client as shared_client
+from chalicelib.model import normalize
+from chalicelib.scheduler import WriteScheduler, write_capacities
+
+BATCH_SIZE = 25  # DynamoDB limit of items per batch write
+CHECKPOINT = "checkpoint-%s.json"
+MANIFEST = "manifest.json"
+ON_DEMAND_CAPACITY = 1000  # pace for tables without provisioned throughput
+
+
+def export_segment(client, table, path, segment, segments):
+    """
+    Scans {segment} of {table} into {path}, returns the items count.
+    """
+    count = 0
+    kwargs = {"TableName": table, "Segment": segment, "TotalSegments": segments}
+    with gzip.open(path, "wt") as file:
+        while True:
+            response = client.scan(**kwargs)
+            for item in response["Items"]:
+                file.write(json.dumps(item) + "\n")
+            count += len(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return count
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def export_table(table, directory, segments=8, client=None):
+    """
+    Parallel segmented scan of {table} into {directory}.
+    """
+    client = client or shared_client("dynamodb")
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):  # of a previous export
+        if name.startswith("segment-") or name == MANIFEST:
+            os.remove(os.path.join(directory, name))
+    paths = [
+        os.path.join(directory, "segment-%04d.ndjson.gz" % segment)
+        for segment in range(segments)
+    ]
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        counts = list(
+            pool.map(
+                lambda segment: export_segment(
+                    client, table, paths[segment], segment, segments
+                ),
+                range(segments),
+            )
+        )
+    manifest = {
+        "table": table,
+        "files": {
+            os.path.basename(path): count for path, count in zip(paths, counts)
+        },
+    }
+    with open(os.path.join(directory, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class Checkpoint:
+    """
+    Lines already imported per file, persisted after every batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as file:
+                self.done = json.load(file)
+        except FileNotFoundError:
+            self.done = {}
+
+    def get(self, name):
+        return self.done.get(name, 0)
+
+    def set(self, name, lines):
+        with self.lock:
+            self.done[name] = lines
+            with open(self.path + ".tmp", "w") as file:
+                json.dump(self.done, file)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def write_batch(client, scheduler, table, items):
+    """
+    Writes {items}, retrying the unprocessed ones until all are stored.
+    """
+    requests = [{"PutRequest": {"Item": item}} for item in items]
+    while requests:
+        response = scheduler(
+            client.batch_write_item,
+            units=len(requests),
+            RequestItems={table: requests},
+        )
+        requests = response.get("UnprocessedItems", {}).get(table, [])
+        if requests:
+            scheduler.throttled("UnprocessedItems")
+
+
+def import_file(client, scheduler, table, path, checkpoint):
+    """
+    Imports the lines of {path} not yet in {checkpoint}, returns them count.
+    """
+    name = os.path.basename(path)
+    done = checkpoint.get(name)
+    batch = []
+    lines = 0
+    with gzip.open(path, "rt") as file:
+        for lines, line in enumerate(file, 1):
+            if lines <= done:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == BATCH_SIZE:
+                write_batch(client, scheduler, table, batch)
+                checkpoint.set(name, lines)
+                batch = []
+    if batch:
+        write_batch(client, scheduler, table, batch)
+    checkpoint.set(name, lines)
+    return lines - done
+
+
+def table_capacity(client, table):
+    """
+    Write capacity pools (table and indexes) of {table}.
+    """
+    description = client.describe_table(TableName=table)["Table"]
+    return {
+        pool: units
+        for pool, units in write_capacities(description).items()
+        if units  # on demand tables and indexes report 0
+    } or ON_DEMAND_CAPACITY
+
+
+def import_table(table, directory, workers=8, capacity=None, client=None):
+    """
+    Imports the snapshot files listed in the manifest of {directory} into
+    {table}, paced by its slowest capacity pool (table or index) unless
+    {capacity} is given.
+    """
+    client = client or shared_client("dynamodb", scheduled=True)
+    if capacity is None:
+        capacity = table_capacity(client, table)
+    scheduler = WriteScheduler(capacity, name=table)
+    checkpoint = Checkpoint(os.path.join(directory, CHECKPOINT % table))
+    with open(os.path.join(directory, MANIFEST)) as file:
+        manifest = json.load(file)
+    paths = [
+        os.path.join(directory, name) for name in sorted(manifest["files"])
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(
+            lambda path: import_file(
+                client, scheduler, table, path, checkpoint
+            ),
+            paths,
+        )
+        return sum(counts)
+
+
+def normalize_segment(client, scheduler, table, segment, segments):
+    """
+    Rewrites the `_sport` of the events of {segment} of {table} not stored
+    in normalized form, returns them count.
+    """
+    count = 0
+    kwargs = {
+        "TableName": table,
+        "Segment": segment,
+        "TotalSegments": segments,
+        "ProjectionExpression": "id, sport.#name, #key",
+        "ExpressionAttributeNames": {"#name": "name", "#key": "_sport"},
+    }
+    while True:
+        response = client.scan(**kwargs)
+        for item in response["Items"]:
+            name = item.get("sport", {}).get("M", {}).get("name", {}).get("S")
+            if name is None or item.get("_sport") == {"S": normalize(name)}:
+                continue
+            try:
+                scheduler(
+                    client.update_item,
+                    TableName=table,
+                    Key={"id": item["id"]},
+                    UpdateExpression="SET #key = :key",
+                    ConditionExpression="attribute_exists(id)",
+                    ExpressionAttributeNames={"#key": "_sport"},
+                    ExpressionAttributeValues={":key": {"S": normalize(name)}},
+                )
+            except client.exceptions.ConditionalCheckFailedException:
+                continue  # expired since scanned
+            count += 1
+        if "LastEvaluatedKey" not in response:
+            return count
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def normalize_table(table, segments=8, capacity=None, client=None):
+    """
+    Parallel segmented backfill of the normalized `_sport` of {table}.
+    """
+    client = client or shared_client("dynamodb", scheduled=True)
+    if capacity is None:
+        capacity = table_capacity(client, table)
+    scheduler = WriteScheduler(capacity, name=table)
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        counts = pool.map(
+            lambda segment: normalize_segment(
+                client, scheduler, table, segment, segments
+            ),
+            range(segments),
+        )
+        return sum(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="dump a table")
+    export.add_argument("table")
+    export.add_argument("directory")
+    export.add_argument("--segments", type=int, default=8)
+
+    load = commands.add_parser("import", help="load a dump into a table")
+    load.add_argument("table")
+    load.add_argument("directory")
+    load.add_argument("--workers", type=int, default=8)
+    load.add_argument(
+        "--capacity",
+        type=float,
+        help="write units per second (default: table's slowest index)",
+    )
+
+    backfill = commands.add_parser(
+        "normalize", help="backfill normalized sport lookup keys"
+    )
+    backfill.add_argument("table")
+    backfill.add_argument("--segments", type=int, default=8)
+    backfill.add_argument(
+        "--capacity",
+        type=float,
+        help="write units per second (default: table's slowest index)",
+    )
+
+    args = parser.parse_args()
+    if args.command == "export":
+        manifest = export_table(args.table, args.directory, args.segments)
+        print("exported %d items" % sum(manifest["files"].values()))
+    elif args.command == "normalize":
+        count = normalize_table(args.table, args.segments, args.capacity)
+        print("normalized %d items" % count)
+    else:
+        count = import_table(
+            args.table, args.directory, args.workers, args.capacity
+        )
+        print("imported %d items" % count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Cold storage for events expired from the betting table
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+import gzip
+import json
+import os
+import uuid
+
+from .codec import default
+from .executor import client
+
+PREFIX = "events"
+
+
+def partition(event):
+    """
+    Date partition of {event}, from its `startTime`.
+    """
+    start_time = datetime.utcfromtimestamp(int(event["startTime"]))
+    return start_time.strftime("date=%Y-%m-%d")
+
+
+def partitions(start, end):
+    """
+    Date partitions from date {start} to date {end}, both included.
+    """
+    for day in range((end - start).days + 1):
+        yield (start + timedelta(days=day)).strftime("date=%Y-%m-%d")
+
+
+def get_archive():
+    """
+    S3 archive when `ARCHIVE_BUCKET` is set, a local directory otherwise.
+    Deployed functions must have a bucket: TTL deletes would be lost.
+    """
+    bucket = os.environ.get("ARCHIVE_BUCKET")
+    if bucket:
+        return S3Archive(bucket)
+    if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+        raise RuntimeError("ARCHIVE_BUCKET is not set, expired events are lost")
+    return LocalArchive(os.environ.get("ARCHIVE_PATH", "/tmp/betting-archive"))
+
+
+class Archive:
+    """
+    Gzipped JSON lines snapshots, one file per date partition and write.
+    """
+
+    def put(self, key, body):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def keys(self, prefix):
+        raise NotImplementedError
+
+    def put_events(self, events):
+        """
+        Writes {events} grouped by date partition, returns the keys written.
+        """
+        partitions = {}
+        for event in events:
+            partitions.setdefault(partition(event), []).append(event)
+
+        keys = []
+        for date, items in sorted(partitions.items()):
+            lines = "".join(
+                json.dumps(item, default=default) + "\n" for item in items
+            )
+            key = "%s/%s/%s.jsonl.gz" % (PREFIX, date, uuid.uuid4().hex)
+            self.put(key, gzip.compress(lines.encode()))
+            keys.append(key)
+        return keys
+
+    def iter_events(self, start, end):
+        """
+        Events archived in the date partitions from {start} to {end}.
+        """
+        for date in partitions(start, end):
+            for key in sorted(self.keys("%s/%s/" % (PREFIX, date))):
+                body = gzip.decompress(self.get(key)).decode()
+                for line in body.splitlines():
+                    if line:
+                        yield json.loads(line, parse_float=Decimal)
+
+
+class LocalArchive(Archive):
+    """
+    Archive on a local directory, stand-in for S3 in tests and `chalice local`.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def put(self, key, body):
+        path = os.path.join(self.path, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(body)
+
+    def get(self, key):
+        with open(os.path.join(self.path, key), "rb") as file:
+            return file.read()
+
+    def keys(self, prefix):
+        for root, _, files in os.walk(os.path.join(self.path, prefix)):
+            for name in files:
+                yield os.path.relpath(os.path.join(root, name), self.path)
+
+
+class S3Archive(Archive):
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.s3 = client("s3")
+
+    def put(self, key, body):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/gzip",
+        )
+
+    def get(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def keys(self, prefix):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"]
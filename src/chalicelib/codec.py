@@ -0,0 +1,118 @@
+"""
+Numeric codec between the JSON edge and storage
+
+Ids are kept as ints, `startTime` as int epoch seconds and odds as ints
+counting millionths, so no Decimal is built on the write path. Floats only
+exist when a message is parsed and when a response is serialized.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+import calendar
+import json
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+ODDS_SCALE = 10 ** 6  # stored odds are millionths
+
+
+def loads(data):
+    """
+    Parses a provider message, floats stay floats until encoded.
+    """
+    return json.loads(data)
+
+
+def default(value):
+    """
+    JSON encoder for the numbers DynamoDB hands back as Decimal.
+    """
+    if isinstance(value, Decimal):
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def encode_odds(odds):
+    """
+    Odds as millionths: exact up to 6 decimals, rounded beyond, far below
+    any price increment.
+    """
+    return int(round(odds * ODDS_SCALE))
+
+
+def decode_odds(scaled):
+    return int(scaled) / ODDS_SCALE
+
+
+def to_epoch(start_time):
+    """
+    Epoch seconds of `startTime` as sent by providers, a UTC date.
+    """
+    if isinstance(start_time, str):
+        date = datetime.strptime(start_time, DATE_FORMAT)
+        start_time = calendar.timegm(date.timetuple())
+    return int(start_time)
+
+
+def from_epoch(start_time):
+    """
+    UTC date of `startTime`, the same the archive partitions by.
+    """
+    return datetime.utcfromtimestamp(int(start_time)).strftime(DATE_FORMAT)
+
+
+def storable(value):
+    """
+    {value} with floats out of the known numeric fields as exact Decimals,
+    the only non integer numbers boto3 accepts.
+    """
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    if isinstance(value, dict):
+        return {key: storable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [storable(item) for item in value]
+    return value
+
+
+def encode_event(event):
+    """
+    Storage form of a provider {event}, ValueError on a bad `startTime`.
+    """
+    event["startTime"] = to_epoch(event["startTime"])
+    event["_odds_scale"] = ODDS_SCALE
+    for market in event.get("markets", []):
+        for selection in market.get("selections", []):
+            if selection.get("odds") is not None:
+                selection["odds"] = encode_odds(selection["odds"])
+    return storable(event)
+
+
+def decode(value):
+    """
+    {value} read from DynamoDB with its Decimals as ints or floats.
+    """
+    if isinstance(value, Decimal):
+        return default(value)
+    if isinstance(value, dict):
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def decode_item(item, scale=None):
+    """
+    JSON edge form of a stored {item}: odds unscaled by {scale} when stored
+    scaled, `startTime` as date.
+    """
+    item = decode(item)
+    if "startTime" in item:
+        item["startTime"] = from_epoch(item["startTime"])
+    if scale:
+        for market in item.get("markets", []):
+            for selection in market.get("selections", []):
+                if selection.get("odds") is not None:
+                    selection["odds"] = selection["odds"] / int(scale)
+    return item
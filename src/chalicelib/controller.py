@@ -1,11 +1,14 @@
-from decimal import Decimal
-import json
+from datetime import datetime
+import time
 
 from chalice import BadRequestError
 
-from . import model
+from . import codec, model
 
 BETS = model.Bets()
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+ARCHIVE_MAX_DAYS = 31  # date partitions read at most per archived listing
 
 
 def get_match_by_id(match_id):
@@ -18,9 +21,45 @@ def get_match_by_id(match_id):
     return match
 
 
+def get_odds_history(match_id, query_params: dict):
+    try:
+        match_id = int(match_id)
+    except ValueError:
+        raise BadRequestError(
+            f"`match_id` must be an integer, got `{match_id}`"
+        )
+
+    resolution = str(query_params.get("resolution", 60))
+    if not resolution.isdigit() or int(resolution) < 1:
+        raise BadRequestError(
+            "`resolution` must be a positive number of seconds, "
+            f"got `{resolution}`"
+        )
+    resolution = int(resolution)
+
+    bounds = {}
+    for param in ("from", "to"):
+        value = query_params.get(param)
+        if value is not None and not str(value).isdigit():
+            raise BadRequestError(
+                f"`{param}` must be epoch seconds, got `{value}`"
+            )
+        bounds[param] = value
+    end = int(bounds["to"] or time.time())
+    start = int(bounds["from"] or end - model.HISTORY_WINDOW)
+    if not 0 <= end - start <= model.HISTORY_MAX_WINDOW:
+        raise BadRequestError(
+            f"`from` must be before `to` and at most "
+            f"{model.HISTORY_MAX_WINDOW} seconds apart"
+        )
+
+    history = BETS.get_odds_history(match_id, resolution, start, end)
+    return history
+
+
 def post_message(data: str):
     """helper for debugging"""
-    payload = json.loads(data, parse_float=Decimal)
+    payload = codec.loads(data)
     result = BETS.post_message(payload)
     return result
 
@@ -29,7 +68,7 @@ def put_message(data):
     """
     `PUT https://domain/api/message`
     """
-    payload = json.loads(data, parse_float=Decimal)
+    payload = codec.loads(data)
     result = BETS.put_message(payload)
     return result
 
@@ -37,14 +76,75 @@ def put_message(data):
 def get_matches(query_params: dict):
     name = query_params.get("name")
     sport = query_params.get("sport")
-    if name and sport:
-        raise NotImplementedError(
-            f"{query_params}, only one of ['name', 'sport'] can be specified"
+    selection = query_params.get("selection")
+    if len([value for value in (name, sport, selection) if value]) > 1:
+        raise BadRequestError(
+            "only one of `name`, `sport` and `selection` can be specified"
         )
     elif name:
         matches = BETS.get_matches_by_name(name)
     elif sport:
         matches = BETS.get_matches_by_sport(sport)
+    elif selection:
+        matches = BETS.get_matches_by_selection(selection)
     else:
         matches = BETS.get_matches_by_name("")
+
+    if query_params.get("include_archived") in ("1", "true"):
+        start, end = archived_range(query_params)
+        matches += BETS.get_archived_matches(
+            start, end, name=name, sport=sport, selection=selection
+        )
     return matches
+
+
+def archived_range(query_params: dict):
+    """
+    Dates `archived_from` and `archived_to` (YYYY-MM-DD) of an archived
+    listing, at most ARCHIVE_MAX_DAYS apart.
+    """
+    dates = []
+    for param in ("archived_from", "archived_to"):
+        value = query_params.get(param, "")
+        try:
+            dates.append(datetime.strptime(value, "%Y-%m-%d").date())
+        except ValueError:
+            raise BadRequestError(
+                f"`{param}` must be a YYYY-MM-DD date, got `{value}`"
+            )
+    start, end = dates
+    if not 0 <= (end - start).days < ARCHIVE_MAX_DAYS:
+        raise BadRequestError(
+            "`archived_from` must be before `archived_to` and at most "
+            f"{ARCHIVE_MAX_DAYS} days apart"
+        )
+    return start, end
+
+
+def get_sports():
+    sports = BETS.get_sports()
+    return sports
+
+
+def get_suggestions(query_params: dict):
+    query = query_params.get("q", "")
+    if not query.strip():
+        raise BadRequestError("`q` is required")
+
+    limit = str(query_params.get("limit", SUGGEST_LIMIT))
+    if not limit.isdigit() or not 1 <= int(limit) <= SUGGEST_MAX_LIMIT:
+        raise BadRequestError(
+            f"`limit` must be between 1 and {SUGGEST_MAX_LIMIT}, got `{limit}`"
+        )
+
+    suggestions = BETS.get_suggestions(query, int(limit))
+    return suggestions
+
+
+def process_stream(records):
+    """
+    Stream handler helper, writes the items derived from the betting table
+    changes and archives the events expired from it.
+    """
+    result = BETS.process_stream(records)
+    return result
@@ -0,0 +1,53 @@
+"""
+Pre-serialized responses served with validators
+"""
+
+import hashlib
+import json
+
+from chalice import Response
+
+CACHE_CONTROL = "public, max-age=86400"
+
+
+class Document:
+    """
+    Immutable response body, serialized and hashed once per container.
+
+    The ETag is weak: API Gateway compresses the body on its way out, so
+    the bytes a client gets depend on its `Accept-Encoding`.
+    """
+
+    def __init__(self, body, content_type="application/json"):
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.body = body
+        self.content_type = content_type
+        self.etag = 'W/"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+    @classmethod
+    def from_file(cls, path, content_type="application/json"):
+        with open(path, "rb") as file:
+            return cls(file.read(), content_type)
+
+    def headers(self):
+        return {
+            "Content-Type": self.content_type,
+            "ETag": self.etag,
+            "Cache-Control": CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+
+    def response(self, request_headers):
+        """
+        Full response, or `304 Not Modified` if the client copy is current
+        (weak comparison, as `If-None-Match` requires).
+        """
+        if_none_match = (request_headers or {}).get("if-none-match", "")
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        if self.etag[2:] in tags or "*" in tags:
+            return Response(body="", status_code=304, headers=self.headers())
+        return Response(body=self.body.decode(), headers=self.headers())
@@ -0,0 +1,98 @@
+"""
+Shared AWS connections and concurrent fan-out of independent requests
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+import time
+
+import boto3
+from botocore.config import Config
+
+MAX_WORKERS = 16  # concurrent requests per container
+CALL_TIMEOUT = 10  # seconds a gathered call may take
+CONFIG = Config(
+    max_pool_connections=MAX_WORKERS * 2,
+    connect_timeout=2,
+    read_timeout=5,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 4},
+)
+# writes paced by a `WriteScheduler`, which retries throttles and transient
+# errors itself: botocore retries underneath would hide them from its rate
+# and metrics
+SCHEDULED_CONFIG = CONFIG.merge(
+    Config(retries={"mode": "standard", "max_attempts": 1})
+)
+
+POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="bets")
+# (function, seconds) of the calls run on POOL, collected while profiling
+TIMINGS = ContextVar("timings", default=None)
+
+
+@lru_cache()
+def session():
+    return boto3.session.Session()
+
+
+@lru_cache()
+def resource(service_name):
+    """
+    Long lived resource, built once per container on the tuned pool.
+    Resources are not thread safe: calls run by `gather` use `client`.
+    """
+    return session().resource(service_name, config=CONFIG)
+
+
+@lru_cache()
+def client(service_name, scheduled=False):
+    """
+    Long lived client, built once per container on the tuned pool. A
+    {scheduled} client does not retry, for writes wrapped by a scheduler.
+    """
+    config = SCHEDULED_CONFIG if scheduled else CONFIG
+    return session().client(service_name, config=config)
+
+
+def timed(timings, function, *args):
+    """
+    Calls {function}, appending its wall time to {timings}.
+    """
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings.append((function, time.perf_counter() - start))
+
+
+def gather(calls, timeout=CALL_TIMEOUT):
+    """
+    Runs {calls}, `(function, *args)` tuples, concurrently and returns their
+    results in order. The first error is raised and the calls not started
+    yet are cancelled; TimeoutError if the calls are not done {timeout}
+    seconds per MAX_WORKERS of them (the ones that wait for a worker
+    included) after being submitted.
+
+    Calls must not gather themselves: nested waits could exhaust the pool.
+    """
+    calls = list(calls)
+    if len(calls) == 1:
+        function, *args = calls[0]
+        return [function(*args)]
+
+    timings = TIMINGS.get()
+    if timings is not None:  # profiling, see `profiling.profile`
+        calls = [(timed, timings) + tuple(call) for call in calls]
+    futures = [POOL.submit(function, *args) for function, *args in calls]
+    waves = -(-len(futures) // MAX_WORKERS)
+    deadline = time.monotonic() + timeout * waves
+    results = []
+    try:
+        for future in futures:
+            results.append(future.result(max(0, deadline - time.monotonic())))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
@@ -3,18 +3,36 @@ Database interface
 """
 
 import os
-from decimal import Decimal as D
-from datetime import datetime
+import time
 
 from Levenshtein import distance
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from chalice import NotFoundError, UnprocessableEntityError
-from functools import reduce
-import boto3
+from doglessdata import DataDogMetrics
+from itertools import chain
 from botocore.exceptions import ClientError
 import jsonschema
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from . import codec
+from .archive import get_archive
+from .executor import MAX_WORKERS, client, gather, resource
+from .scheduler import WriteScheduler, write_capacities
+
+ODDS_BUCKET = 3600  # seconds of samples held by each odds history item
+HISTORY_WINDOW = 24 * 3600  # seconds of odds history read by default
+HISTORY_MAX_WINDOW = 7 * 24 * 3600  # longest odds history read at once
+BATCH_SIZE = 25  # DynamoDB limit of items per batch write
+TRANSACT_SIZE = 100  # DynamoDB limit of items per transaction
+TRANSIENT_CANCELLATIONS = {"None", "ThrottlingError", "TransactionConflict"}
+MESSAGE_UNITS = 4 * BATCH_SIZE  # meta writes derived from a large message
+CAPACITY_REFRESH = 300  # seconds between provisioned capacity reads
+SCAN_SEGMENTS = 4  # parallel scan segments
+ARCHIVE_AFTER = 7 * 24 * 3600  # seconds after `startTime` an event stays hot
+TTL_ATTRIBUTE = "_expires"
+SUGGEST_PREFIX = 3  # longest word prefix with its own suggestion bucket
+SUGGEST_PAGE = 100  # bucket items read per query page
+SUGGEST_PAGES = 5  # pages read at most to fill a suggestion list
 BET_TABLE_MAP = {
     "AttributeDefinitions": [
         {"AttributeName": "id", "AttributeType": "N"},
@@ -36,8 +54,25 @@ BET_TABLE_MAP = {
             "ProvisionedThroughput": {"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
         }
     ],
+    "StreamSpecification": {
+        "StreamEnabled": True,
+        "StreamViewType": "NEW_AND_OLD_IMAGES",
+    },
+}
+META_TABLE_MAP = {
+    "AttributeDefinitions": [
+        {"AttributeName": "_pk", "AttributeType": "S"},
+        {"AttributeName": "_sk", "AttributeType": "S"},
+    ],
+    "KeySchema": [
+        {"AttributeName": "_pk", "KeyType": "HASH"},
+        {"AttributeName": "_sk", "KeyType": "RANGE"},
+    ],
+    "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
 }
 
+metrics = DataDogMetrics()
+
 
 SCHEMA_MESSAGE = {
     "type": "object",
@@ -88,15 +123,284 @@ SCHEMA_MESSAGE = {
 
 def clean_dict(insecure_dict):
     """
-    Deletes private items in dict.
+    Deletes private items in dict, decodes stored numbers.
     """
     clean_dict = {key: value
                   for key, value in insecure_dict.items()
                   if not key.startswith("_")}
-    if "startTime" in clean_dict:
-        start_time = datetime.fromtimestamp(clean_dict["startTime"])
-        clean_dict["startTime"] = start_time.strftime(DATE_FORMAT)
-    return clean_dict
+    return codec.decode_item(clean_dict, insecure_dict.get("_odds_scale"))
+
+
+def normalize(name):
+    """
+    Case and whitespace insensitive form of {name}, used as lookup key.
+    """
+    return " ".join(name.casefold().split())
+
+
+def serialize(item):
+    """
+    DynamoDB JSON of {item}, for the low level client.
+    """
+    serializer = TypeSerializer()
+    return {key: serializer.serialize(value) for key, value in item.items()}
+
+
+def deserialize(item):
+    """
+    {item} out of DynamoDB JSON.
+    """
+    deserializer = TypeDeserializer()
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+
+def encode_event(event):
+    """
+    Storage form of {event}, see `codec`.
+    """
+    try:
+        return codec.encode_event(event)
+    except ValueError as error:
+        raise UnprocessableEntityError(str(error))
+
+
+def expires_at(start_time):
+    """
+    Epoch seconds after which an event starting at {start_time} is archived.
+    """
+    return int(start_time) + ARCHIVE_AFTER
+
+
+def changes(records):
+    """
+    Yields the change, timestamp and image (the new one, the old one for
+    removals) of every item in DynamoDB stream {records}.
+    """
+    for record in records:
+        change = record.get("eventName")
+        data = record["dynamodb"]
+        timestamp = int(data.get("ApproximateCreationDateTime") or time.time())
+        if change == "REMOVE":
+            yield change, timestamp, deserialize(data["OldImage"])
+        elif change in ("INSERT", "MODIFY"):
+            yield change, timestamp, deserialize(data["NewImage"])
+
+
+def expired_items(records):
+    """
+    Old images of the items that TTL removed, out of DynamoDB stream {records}.
+    """
+    for record in records:
+        identity = record.get("userIdentity") or {}
+        if record.get("eventName") != "REMOVE":
+            continue
+        if identity.get("principalId") != "dynamodb.amazonaws.com":
+            continue
+        yield deserialize(record["dynamodb"]["OldImage"])
+
+
+def matches_filter(item, name=None, sport=None, selection=None):
+    """
+    Tells if a stored {item} matches the `/matches` filters.
+    """
+    if name:
+        names = " ".join(name if isinstance(name, list) else [name])
+        words = [word.casefold() for word in names.split() if 3 <= len(word)]
+        return any(word in item["name"].casefold() for word in words)
+    if sport:
+        return item.get("_sport") == normalize(sport)
+    if selection:
+        key = selection_key(selection)
+        return any(
+            selection_key(value) == key
+            for market in item.get("markets", [])
+            for choice in market.get("selections", [])
+            for value in (choice.get("name"), choice.get("id"))
+            if value is not None
+        )
+    return False
+
+
+def selection_key(selection):
+    """
+    Partition key of the selection adjacency list for a name or an id.
+    """
+    selection = str(selection).strip()
+    if selection.isdigit():
+        return "selection_id#%d" % int(selection)
+    return "selection#%s" % normalize(selection)
+
+
+def selection_items(match):
+    """
+    Yields one adjacency item per selection (by name and by id) of {match}.
+    """
+    sort_key = "%012d#%d" % (int(match["startTime"]), match["id"])
+    for market in match.get("markets", []):
+        for selection in market.get("selections", []):
+            for key in (selection.get("name"), selection.get("id")):
+                if key is None:
+                    continue
+                yield {
+                    "_pk": selection_key(key),
+                    "_sk": sort_key,
+                    "id": match["id"],
+                    "name": match["name"],
+                    "startTime": match["startTime"],
+                    TTL_ATTRIBUTE: expires_at(match["startTime"]),
+                }
+
+
+def prefixes(name):
+    """
+    Suggestion buckets of {name}: the word prefixes up to SUGGEST_PREFIX long.
+    """
+    return {
+        word[:length]
+        for word in normalize(name).split()
+        for length in range(1, min(len(word), SUGGEST_PREFIX) + 1)
+    }
+
+
+def suggestion_items(match):
+    """
+    Yields the prefix bucket items of {match} and its selections names.
+    """
+    entries = [("match", match["name"], match["id"])]
+    for market in match.get("markets", []):
+        for selection in market.get("selections", []):
+            name, uid = selection.get("name"), selection.get("id")
+            if name and uid is not None:
+                entries.append(("selection", name, uid))
+
+    for kind, name, uid in entries:
+        for prefix in prefixes(name):
+            yield {
+                "_pk": "prefix#%s" % prefix,
+                "_sk": "%012d#%s#%d" % (int(match["startTime"]), kind, uid),
+                "kind": kind,
+                "id": uid,
+                "name": name,
+                "startTime": match["startTime"],
+                TTL_ATTRIBUTE: expires_at(match["startTime"]),
+            }
+
+
+def suggestion_matches(query, name):
+    """
+    True if every word of {query} starts a word of {name}.
+    """
+    words = normalize(name).split()
+    return all(
+        any(word.startswith(term) for word in words)
+        for term in normalize(query).split()
+    )
+
+
+def catalog_entries(event):
+    """
+    Yields the key and attributes of the catalog counters {event} counts in:
+    its sport and each of its markets.
+    """
+    sport = normalize(event["sport"]["name"])
+    yield {"_pk": "catalog", "_sk": "sport#%s" % sport}, {
+        "name": event["sport"]["name"],
+        "id": event["sport"]["id"],
+    }
+    markets = {
+        normalize(market["name"]): market for market in event.get("markets", [])
+    }
+    for market, item in markets.items():
+        yield {"_pk": "catalog", "_sk": "market#%s#%s" % (sport, market)}, {
+            "name": item["name"],
+        }
+
+
+def count_markers(event):
+    """
+    Yields the markers of the catalog counters {event} counts in, one per
+    transaction of up to TRANSACT_SIZE items, with their entries.
+    """
+    entries = list(catalog_entries(event))
+    size = TRANSACT_SIZE - 1  # and the marker
+    for chunk, start in enumerate(range(0, len(entries), size)):
+        part = entries[start:start + size]
+        marker = {
+            "_pk": "counted#%d" % event["id"],
+            "_sk": "%04d" % chunk,
+            "keys": [key["_sk"] for key, _ in part],
+        }
+        yield marker, part
+
+
+def catalog(items):
+    """
+    Sports with their markets and unarchived events counts out of catalog
+    {items}.
+    """
+    sports = {}
+    markets = []
+    for item in items:
+        kind, sport, *market = item["_sk"].split("#", 2)
+        events = int(item.get("events", 0))
+        entry = {"name": item["name"], "unarchived_events": events}
+        if kind == "sport":
+            entry["id"] = int(item["id"])
+            entry["markets"] = []
+            sports[sport] = entry
+        else:
+            markets.append((sport, entry))
+    for sport, entry in markets:
+        if sport in sports:
+            sports[sport]["markets"].append(entry)
+    return list(sports.values())
+
+
+def odds_samples(event, timestamp):
+    """
+    Yields the history item key and compact `offset:odds` sample of every
+    selection in {event} at {timestamp}.
+    """
+    bucket = timestamp - timestamp % ODDS_BUCKET
+    for market in event.get("markets", []):
+        for selection in market.get("selections", []):
+            if selection.get("id") is None or selection.get("odds") is None:
+                continue
+            odds = int(selection["odds"])  # already scaled, see codec
+            key = {
+                "_pk": "odds#%d" % event["id"],
+                "_sk": "%012d#%d" % (bucket, selection["id"]),
+            }
+            yield key, "%d:%d" % (timestamp - bucket, odds)
+
+
+def downsample(items, resolution, start=None, end=None):
+    """
+    Reduces odds history {items} to the last sample of each {resolution}
+    seconds window, per selection, skipping samples out of [{start}, {end}].
+    """
+    series = {}
+    for item in items:
+        bucket, selection_id = (int(part) for part in item["_sk"].split("#"))
+        windows = series.setdefault(selection_id, {})
+        for sample in item.get("samples", []):
+            offset, odds = (int(part) for part in sample.split(":"))
+            timestamp = bucket + offset
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and end < timestamp:
+                continue
+            windows[timestamp - timestamp % resolution] = odds
+    return [
+        {
+            "id": selection_id,
+            "odds": [
+                [timestamp, codec.decode_odds(odds)]
+                for timestamp, odds in sorted(windows.items())
+            ],
+        }
+        for selection_id, windows in series.items()
+    ]
 
 
 class Bets:
@@ -105,34 +409,107 @@ class Bets:
     """
 
     table = None
+    meta_table = None
+    archive = None
 
-    def __init__(self, table_name=None):
-        """Initialize tables"""
+    def __init__(self, table_name=None, meta_table_name=None):
+        """
+        Initialize tables, named by the stage configuration (`BETS_TABLE`
+        and `BETS_META_TABLE`) unless given: every function of the app,
+        the stream handler included, works on the same tables.
+        """
+        if table_name is None:
+            table_name = os.environ.get("BETS_TABLE", "betting-table-dev")
+        if meta_table_name is None:
+            meta_table_name = os.environ.get(
+                "BETS_META_TABLE", "%s-meta" % table_name
+            )
         self.table_name = table_name
-        self.dynamodb = boto3.resource("dynamodb")
+        self.meta_table_name = meta_table_name
+        # without a stream handler the requests write the derived items
+        self.inline = not os.environ.get("BETS_STREAM_ARN")
+        self.capacities_read = None
+        self.writes = WriteScheduler(
+            write_capacities(BET_TABLE_MAP), name="bets", metrics=metrics
+        )
+        self.meta_writes = WriteScheduler(
+            write_capacities(META_TABLE_MAP),
+            name="meta",
+            metrics=metrics,
+            burst=MESSAGE_UNITS,
+            retries=4,  # backoff stays well within a gathered call timeout
+            max_delay=1.0,
+        )
 
     def init_table(self):
         """
         Looks for matching export.
-        Creates table interface resource instance.
+        Creates table interface resource instances, and the thread safe
+        clients used by gathered calls and scheduled writes. Deployed
+        tables belong to the data stack (`make deploy_data`), they are only
+        created when running locally.
         """
-        if self.table_name is None:
-            this = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "bet-dev")
-            stage = this.split("-")[-1]
-            self.table_name = "betting-table-%s" % stage
-
-        if not self.table:
-            try:
-                table = self.dynamodb.create_table(TableName=self.table_name, **BET_TABLE_MAP)
-                table.meta.client.get_waiter('table_exists').wait(TableName='users')
-            except Exception as error:
-                if error.__class__.__name__ != "ResourceInUseException":
-                    raise RuntimeError(
-                        "Create table if not exists request "
-                        f"failed: Exception of type {type(error)} "
-                        f"occurred: {error}"
-                    )
+        self.dynamodb = resource("dynamodb")
+        self.client = client("dynamodb")
+        self.writer = client("dynamodb", scheduled=True)
+        if not self.table and "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
             self.table = self.dynamodb.Table(self.table_name)
+            self.meta_table = self.dynamodb.Table(self.meta_table_name)
+        if not self.table:
+            self.table = self.create_table(self.table_name, BET_TABLE_MAP)
+            self.meta_table = self.create_table(
+                self.meta_table_name, META_TABLE_MAP
+            )
+        self.read_capacities()
+
+    def read_capacities(self):
+        """
+        Paces writes to the capacity the tables are provisioned with now,
+        read every CAPACITY_REFRESH seconds: autoscaling moves it.
+        """
+        now = time.monotonic()
+        read = self.capacities_read
+        if read is not None and now < read + CAPACITY_REFRESH:
+            return
+        self.capacities_read = now
+        for scheduler, table_name in (
+            (self.writes, self.table_name),
+            (self.meta_writes, self.meta_table_name),
+        ):
+            response = self.client.describe_table(TableName=table_name)
+            capacity = {
+                pool: units
+                for pool, units in write_capacities(response["Table"]).items()
+                if units  # on demand tables and indexes report 0
+            }
+            if capacity:
+                scheduler.resize(capacity)
+
+    def create_table(self, table_name, table_map):
+        """
+        Creates {table_name} if not exists, returns its resource instance.
+        """
+        try:
+            table = self.dynamodb.create_table(
+                TableName=table_name, **table_map
+            )
+            waiter = table.meta.client.get_waiter("table_exists")
+            waiter.wait(TableName=table_name)
+            table.meta.client.update_time_to_live(
+                TableName=table_name,
+                TimeToLiveSpecification={
+                    "Enabled": True,
+                    "AttributeName": TTL_ATTRIBUTE,
+                },
+            )
+        except Exception as error:
+            if error.__class__.__name__ != "ResourceInUseException":
+                raise RuntimeError(
+                    "Create table if not exists request "
+                    f"failed: Exception of type {type(error)} "
+                    f"occurred: {error}"
+                )
+        return self.dynamodb.Table(table_name)
 
     def get_match(self, match_id):
         self.init_table()
@@ -147,26 +524,374 @@ class Bets:
         self.init_table()
         key_sport = Key("_sport")
         response = self.table.query(
-            IndexName="sport_startTime", KeyConditionExpression=key_sport.eq(sport)
+            IndexName="sport_startTime",
+            KeyConditionExpression=key_sport.eq(normalize(sport)),
+        )
+        items = response["Items"]
+        items = [clean_dict(item) for item in items]
+        return items
+
+    def get_matches_by_selection(self, selection):
+        """
+        Matches where a team or player, by name or selection id, takes part.
+        """
+        self.init_table()
+        key_selection = Key("_pk")
+        response = self.meta_table.query(
+            KeyConditionExpression=key_selection.eq(selection_key(selection))
         )
         items = response["Items"]
         items = [clean_dict(item) for item in items]
         return items
 
+    def get_suggestions(self, query, limit):
+        """
+        Up to {limit} match and team names starting with {query}, latest first.
+        """
+        self.init_table()
+        terms = normalize(query).split()
+        if not terms:
+            return []
+        bucket = max(terms, key=len)[:SUGGEST_PREFIX]
+        kwargs = {
+            "KeyConditionExpression": Key("_pk").eq("prefix#%s" % bucket),
+            "ScanIndexForward": False,
+            "Limit": SUGGEST_PAGE,
+        }
+        suggestions = {}
+        for _ in range(SUGGEST_PAGES):
+            response = self.meta_table.query(**kwargs)
+            for item in response["Items"]:
+                if not suggestion_matches(query, item["name"]):
+                    continue
+                if item["kind"] == "selection":
+                    key = (item["kind"], normalize(item["name"]))
+                else:
+                    key = (item["kind"], item["id"])
+                if key not in suggestions:
+                    suggestions[key] = {
+                        "kind": item["kind"],
+                        "id": int(item["id"]),
+                        "name": item["name"],
+                    }
+                if len(suggestions) == limit:
+                    return list(suggestions.values())
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return list(suggestions.values())
+
+    def get_sports(self):
+        """
+        Sports catalog with events counts, one small query.
+        """
+        self.init_table()
+        key_catalog = Key("_pk").eq("catalog")
+        response = self.meta_table.query(KeyConditionExpression=key_catalog)
+        items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            response = self.meta_table.query(
+                KeyConditionExpression=key_catalog,
+                ExclusiveStartKey=response["LastEvaluatedKey"],
+            )
+            items.extend(response["Items"])
+        return catalog(items)
+
+    def counter_update(self, key, attributes, delta):
+        """
+        Transaction item adding {delta} to the events counter of catalog
+        entry {key}, setting its {attributes} when new.
+        """
+        names = {"#%s" % name: name for name in attributes}
+        names["#events"] = "events"
+        values = {":%s" % name: value for name, value in attributes.items()}
+        values[":delta"] = delta
+        update = "ADD #events :delta"
+        if attributes:
+            update += " SET " + ", ".join(
+                "#%s = if_not_exists(#%s, :%s)" % (name, name, name)
+                for name in attributes
+            )
+        return {
+            "Update": {
+                "TableName": self.meta_table_name,
+                "Key": serialize(key),
+                "UpdateExpression": update,
+                "ExpressionAttributeNames": names,
+                "ExpressionAttributeValues": serialize(values),
+            }
+        }
+
+    def transact(self, items):
+        """
+        Writes {items} in one transaction, led by a conditional marker
+        write. Returns False when the marker condition fails, retries the
+        conflicts with other transactions.
+        """
+        scheduler = self.meta_writes
+        for attempt in range(scheduler.retries + 1):
+            try:
+                scheduler(
+                    self.writer.transact_write_items,
+                    units=2 * len(items),  # transactional writes cost twice
+                    wait=False,
+                    TransactItems=items,
+                )
+                return True
+            except ClientError as error:
+                reasons = error.response.get("CancellationReasons") or [{}]
+                codes = [reason.get("Code") for reason in reasons]
+                if codes[0] == "ConditionalCheckFailed":
+                    return False
+                if not set(codes) <= TRANSIENT_CANCELLATIONS:
+                    raise
+                if attempt == scheduler.retries:
+                    raise
+                scheduler.sleep(scheduler.backoff(attempt))
+
+    def count_event(self, match):
+        """
+        Adds {match} to the counters of its catalog entries, exactly once:
+        each transaction puts a marker of the entries it counted, and does
+        nothing if the marker is there already.
+        """
+        names = {"#pk": "_pk"}
+        for marker, entries in count_markers(match):
+            self.transact([
+                {
+                    "Put": {
+                        "TableName": self.meta_table_name,
+                        "Item": serialize(marker),
+                        "ConditionExpression": "attribute_not_exists(#pk)",
+                        "ExpressionAttributeNames": names,
+                    }
+                }
+            ] + [
+                self.counter_update(key, attributes, 1)
+                for key, attributes in entries
+            ])
+
+    def uncount_event(self, match):
+        """
+        Removes {match} from the counters it was counted in, once: each
+        transaction deletes the marker of the entries it uncounts.
+        """
+        names = {"#pk": "_pk"}
+        response = self.client.query(
+            TableName=self.meta_table_name,
+            KeyConditionExpression="#pk = :pk",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=serialize(
+                {":pk": "counted#%d" % match["id"]}
+            ),
+        )
+        for item in response["Items"]:
+            marker = deserialize(item)
+            key = {"_pk": marker["_pk"], "_sk": marker["_sk"]}
+            self.transact([
+                {
+                    "Delete": {
+                        "TableName": self.meta_table_name,
+                        "Key": serialize(key),
+                        "ConditionExpression": "attribute_exists(#pk)",
+                        "ExpressionAttributeNames": names,
+                    }
+                }
+            ] + [
+                self.counter_update({"_pk": "catalog", "_sk": sort_key}, {}, -1)
+                for sort_key in marker["keys"]
+            ])
+
+    def counted(self, match):
+        """
+        Tells if the changes derived from the insert of {match} are all
+        written: its counters, written last, are.
+        """
+        *_, (marker, _) = count_markers(match)
+        key = {"_pk": marker["_pk"], "_sk": marker["_sk"]}
+        response = self.client.get_item(
+            TableName=self.meta_table_name,
+            Key=serialize(key),
+            ProjectionExpression="#pk",
+            ExpressionAttributeNames={"#pk": "_pk"},
+        )
+        return "Item" in response
+
+    def index_calls(self, match):
+        """
+        Batch writes of the selection adjacency and suggestion bucket items
+        of {match}, as `gather` calls.
+        """
+        items = chain(selection_items(match), suggestion_items(match))
+        items = {(item["_pk"], item["_sk"]): item for item in items}
+        requests = [
+            {"PutRequest": {"Item": serialize(item)}} for item in items.values()
+        ]
+        return [
+            (self.put_meta_batch, requests[start:start + BATCH_SIZE])
+            for start in range(0, len(requests), BATCH_SIZE)
+        ]
+
+    def derived_calls(self, change, match, timestamp):
+        """
+        Meta writes derived from a {change} of {match}, as `gather` calls:
+        inserted matches get their selection adjacency and suggestion
+        buckets, and every version its odds history samples. Names and
+        selections are not updated by odds messages, so modified matches
+        only append samples. Removed ones leave the catalog counters.
+        """
+        if change == "REMOVE":
+            return [(self.uncount_event, match)]
+        expires = expires_at(match["startTime"])
+        calls = [
+            (self.put_odds_sample, key, sample, expires)
+            for key, sample in odds_samples(match, timestamp)
+        ]
+        if change == "INSERT":
+            calls += self.index_calls(match)
+        return calls
+
+    def apply(self, change, match, timestamp=None):
+        """
+        Writes the meta items derived from a {change} of {match}, paced: up
+        to MAX_WORKERS concurrent writes, once the capacity spent by the
+        previous ones is paid. All writes are idempotent, inserts are
+        counted last, once the rest is written, see `counted`.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        calls = self.derived_calls(change, match, timestamp)
+        for start in range(0, len(calls), MAX_WORKERS):
+            self.meta_writes.pace()
+            gather(calls[start:start + MAX_WORKERS])
+        if change == "INSERT":
+            self.meta_writes.pace()
+            self.count_event(match)
+
+    def put_meta_batch(self, requests):
+        """
+        Batch writes {requests} to the meta table, retrying unprocessed ones.
+        """
+        while requests:
+            response = self.meta_writes(
+                self.writer.batch_write_item,
+                units=len(requests),
+                wait=False,
+                RequestItems={self.meta_table_name: requests},
+            )
+            unprocessed = response.get("UnprocessedItems", {})
+            requests = unprocessed.get(self.meta_table_name, [])
+            if requests:
+                self.meta_writes.throttled("UnprocessedItems")
+
+    def put_odds_sample(self, key, sample, expires):
+        """
+        Appends {sample} to an odds history item, no read before write.
+        """
+        self.meta_writes(
+            self.writer.update_item,
+            wait=False,
+            TableName=self.meta_table_name,
+            Key=serialize(key),
+            UpdateExpression=(
+                "SET samples = "
+                "list_append(if_not_exists(samples, :empty), :new), "
+                "#expires = :expires"
+            ),
+            ExpressionAttributeNames={"#expires": TTL_ATTRIBUTE},
+            ExpressionAttributeValues=serialize({
+                ":empty": [],
+                ":new": [sample],
+                ":expires": expires,
+            }),
+        )
+
+    def process_stream(self, records):
+        """
+        Applies the changes in DynamoDB stream {records} to the meta table
+        and archives the events removed by TTL. Batches are retried until
+        they succeed, so derived items are eventually written.
+        """
+        self.init_table()
+        if not self.archive:
+            self.archive = get_archive()
+        events = list(expired_items(records))
+        keys = self.archive.put_events(events) if events else []
+        applied = 0
+        for change, timestamp, match in changes(records):
+            self.apply(change, match, timestamp)
+            applied += 1
+        return {"archived": len(events), "keys": keys, "applied": applied}
+
+    def get_archived_matches(self, start, end, **filters):
+        """
+        Archived matches started from date {start} to date {end}, same
+        filters as `/matches`. Only those date partitions are read.
+        """
+        if not self.archive:
+            self.archive = get_archive()
+        return [
+            clean_dict({key: event[key] for key in ("id", "name", "startTime")})
+            for event in self.archive.iter_events(start, end)
+            if matches_filter(event, **filters)
+        ]
+
+    def get_odds_history(self, match_id, resolution, start, end):
+        """
+        Odds series of match {match_id} between epoch seconds {start} and
+        {end}, one point every {resolution} seconds. Only the hourly items
+        of that window are read; NotFoundError if the match is unknown.
+        """
+        self.init_table()
+        key_odds = Key("_pk").eq("odds#%d" % match_id) & Key("_sk").between(
+            "%012d" % (start - start % ODDS_BUCKET),
+            "%012d#~" % (end - end % ODDS_BUCKET),
+        )
+        response = self.meta_table.query(KeyConditionExpression=key_odds)
+        items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            response = self.meta_table.query(
+                KeyConditionExpression=key_odds,
+                ExclusiveStartKey=response["LastEvaluatedKey"],
+            )
+            items.extend(response["Items"])
+        if not items:
+            response = self.table.get_item(
+                Key={"id": match_id}, ProjectionExpression="id"
+            )
+            if "Item" not in response:
+                raise NotFoundError(f"{match_id} not found")
+        return {
+            "id": match_id,
+            "resolution": resolution,
+            "selections": downsample(items, resolution, start, end),
+        }
+
     def get_matches_by_name(self, names):
         self.init_table()
-        attr_name = Attr("name")
         names = " ".join(names)
         words = [word for word in names.split() if 3 <= len(word)]
-        filters = [attr_name.contains(word) for word in words]
+        values = {":word%d" % index: word for index, word in enumerate(words)}
 
-        if not filters:
+        if not values:
             return []
 
-        filter_expression = reduce(lambda left, right: left | right, filters)
-
-        response = self.table.scan(FilterExpression=filter_expression)
-        matches = [clean_dict(item) for item in response["Items"]]
+        filters = {
+            "FilterExpression": " OR ".join(
+                "contains(#name, %s)" % value for value in values
+            ),
+            "ExpressionAttributeNames": {"#name": "name"},
+            "ExpressionAttributeValues": serialize(values),
+        }
+        segments = gather(
+            (self.scan_segment, filters, segment)
+            for segment in range(SCAN_SEGMENTS)
+        )
+        matches = [
+            clean_dict(deserialize(item))
+            for items in segments
+            for item in items
+        ]
 
         def relevance(match):
             name = match["name"]
@@ -176,6 +901,25 @@ class Bets:
         matches.sort(key=relevance, reverse=True)
         return matches
 
+    def scan_segment(self, filters, segment):
+        """
+        Items, in DynamoDB JSON, of scan {segment} out of SCAN_SEGMENTS
+        matching {filters} (the filter expression parameters).
+        """
+        kwargs = dict(
+            filters,
+            TableName=self.table_name,
+            Segment=segment,
+            TotalSegments=SCAN_SEGMENTS,
+        )
+        response = self.client.scan(**kwargs)
+        items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+            response = self.client.scan(**kwargs)
+            items.extend(response["Items"])
+        return items
+
     def put_message(self, message):
         self.init_table()
         try:
@@ -184,17 +928,29 @@ class Bets:
             message = f"{error}\n\nExpected schema:\n{SCHEMA_MESSAGE}"
             raise UnprocessableEntityError(message)
 
-        match = message["event"]
-        match["_sport"] = match["sport"]["name"]  # trick to allow nested indexing
+        match = encode_event(message["event"])
+        # allows nested indexing
+        match["_sport"] = normalize(match["sport"]["name"])
+        match[TTL_ATTRIBUTE] = expires_at(match["startTime"])
 
         new_item = "attribute_not_exists(id)"
         try:
-            response = self.table.put_item(Item=match, ConditionExpression=new_item)
+            response = self.writes(
+                self.writer.put_item,
+                TableName=self.table_name,
+                Item=serialize(match),
+                ConditionExpression=new_item,
+            )
         except ClientError as error:
             response = error.response
             uid = match["id"]
             if response["Error"]["Code"] == "ConditionalCheckFailedException":
                 response = {"reason": f"The match with id `{uid}` already exists."}
+                if self.inline and not self.counted(match):
+                    self.apply("INSERT", match)  # retry of a failed insert
+        else:
+            if self.inline:
+                self.apply("INSERT", match)
         return response
 
     def post_message(self, payload):
@@ -205,9 +961,19 @@ class Bets:
             message = "%s\n\nExpected schema:\n%s" % (error, SCHEMA_MESSAGE)
             raise UnprocessableEntityError(message)
 
-        event = payload["event"]
-        start_time = event["startTime"]
-        start_time = datetime.strptime(start_time, DATE_FORMAT)
-        event["startTime"] = D(start_time.timestamp())
-        response = self.table.put_item(Item=event)
+        event = encode_event(payload["event"])
+        event["_sport"] = normalize(event["sport"]["name"])
+        event[TTL_ATTRIBUTE] = expires_at(event["startTime"])
+        response = self.writes(
+            self.writer.put_item,
+            TableName=self.table_name,
+            Item=serialize(event),
+            ReturnValues="ALL_OLD",
+        )
+        old = response.pop("Attributes", None)
+        if self.inline:
+            # no old image, or an empty one, is an insert, and so is the
+            # retry of an insert whose derived items were not all written
+            inserted = not old or not self.counted(event)
+            self.apply("INSERT" if inserted else "MODIFY", event)
         return response
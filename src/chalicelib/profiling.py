@@ -0,0 +1,110 @@
+"""
+Request profiling summaries
+"""
+
+import cProfile
+import json
+import pstats
+import random
+
+from chalice import Response
+
+from .codec import default
+from .executor import TIMINGS
+
+CATEGORIES = {
+    "boto3": ("boto3", "botocore", "s3transfer", "urllib3"),
+    "jsonschema": ("jsonschema",),
+    "levenshtein": ("Levenshtein",),
+    "serialization": ("json", "gzip", "zlib", "codec"),
+}
+TOP = 20
+WAITING = ("~", 0, "<method 'acquire' of '_thread.lock' objects>")
+
+
+def sampled(rate):
+    """
+    True once every {rate} calls on average, never if {rate} is not positive.
+    """
+    return rate > 0 and random.randrange(rate) == 0
+
+
+def category(filename, function):
+    """
+    Category of the time spent in {function} defined in {filename}.
+    """
+    path = filename.replace("\\", "/")
+    for name, modules in CATEGORIES.items():
+        for module in modules:
+            if "/%s/" % module in path or "/%s.py" % module in path:
+                return name
+            if filename == "~" and module.casefold() in function.casefold():
+                return name
+    return "other"
+
+
+def profile(view_function, *args, **kwargs):
+    """
+    Runs {view_function} and serializes its response under the profiler.
+
+    The profiler only sees the calling thread: calls fanned out with
+    `executor.gather` are timed instead, and returned as `gathered`.
+    """
+    profiler = cProfile.Profile()
+    gathered = []
+    token = TIMINGS.set(gathered)
+    profiler.enable()
+    try:
+        response = view_function(*args, **kwargs)
+        if not isinstance(response, Response):
+            json.dumps(response, default=default)
+    finally:
+        profiler.disable()
+        TIMINGS.reset(token)
+    return response, profiler, gathered
+
+
+def summarize(profiler, gathered=(), top=TOP):
+    """
+    Own time per category and the {top} functions by cumulative time.
+
+    {gathered} calls, mostly DynamoDB requests, count as boto3 time; the
+    request thread waiting for them is reported apart, as `waiting`.
+    """
+    stats = pstats.Stats(profiler).stats
+    categories = dict.fromkeys(list(CATEGORIES) + ["other"], 0.0)
+    waiting = 0.0
+    functions = []
+    for (filename, line, function), values in stats.items():
+        _, calls, own_time, cumulative, _ = values
+        if (filename, line, function) == WAITING:
+            waiting += own_time
+        else:
+            categories[category(filename, function)] += own_time
+        functions.append(
+            {
+                "function": "%s:%d(%s)" % (filename, line, function),
+                "calls": calls,
+                "cumulative": round(cumulative, 6),
+            }
+        )
+    functions.sort(key=lambda item: item["cumulative"], reverse=True)
+
+    calls = {}
+    for function, seconds in gathered:
+        name = getattr(function, "__qualname__", repr(function))
+        count, total = calls.get(name, (0, 0.0))
+        calls[name] = (count + 1, total + seconds)
+        categories["boto3"] += seconds
+    return {
+        "total": round(sum(categories.values()), 6),
+        "categories": {
+            name: round(value, 6) for name, value in categories.items()
+        },
+        "waiting": round(waiting, 6),
+        "gathered": [
+            {"function": name, "calls": count, "total": round(total, 6)}
+            for name, (count, total) in sorted(calls.items())
+        ],
+        "top": functions[:top],
+    }
@@ -0,0 +1,217 @@
+"""
+Write scheduling against provisioned table capacity
+"""
+
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+THROTTLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+}
+TRANSIENT_ERRORS = {"InternalServerError", "ServiceUnavailable"}
+
+
+def write_capacities(table_map):
+    """
+    Write capacity units of a table, as `{"table": units, index: units}`.
+    """
+    units = {"table": table_map["ProvisionedThroughput"]["WriteCapacityUnits"]}
+    for index in table_map.get("GlobalSecondaryIndexes", []):
+        throughput = index["ProvisionedThroughput"]
+        units[index["IndexName"]] = throughput["WriteCapacityUnits"]
+    return units
+
+
+def consumed_units(consumed):
+    """
+    Units spent per capacity pool, `table` or index name, out of one
+    `ConsumedCapacity` entry.
+    """
+    if "Table" not in consumed:  # no breakdown, all spent on the table
+        return {"table": consumed.get("CapacityUnits", 0)}
+    units = {"table": consumed["Table"].get("CapacityUnits", 0)}
+    for index, spent in consumed.get("GlobalSecondaryIndexes", {}).items():
+        units[index] = spent.get("CapacityUnits", 0)
+    return units
+
+
+class TokenBucket:
+    """
+    Capacity units refilled at {rate} per second, up to {burst}.
+
+    Tokens can go negative: a write spends its estimate up front and the
+    debt is paid by waiting, so callers are served in arrival order.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        refilled = self.tokens + (now - self.updated) * self.rate
+        self.tokens = min(self.burst, refilled)
+        self.updated = now
+
+    def acquire(self, units):
+        """
+        Spends {units}, returns the seconds to wait before using them.
+        """
+        with self.lock:
+            self.refill()
+            self.tokens -= units
+            return max(0, -self.tokens / self.rate)
+
+    def adjust(self, units):
+        """
+        Corrects the balance by {units} once the real consumption is known.
+        """
+        with self.lock:
+            self.tokens -= units
+
+
+class WriteScheduler:
+    """
+    Paces writes to {capacity} units per second, with room for {burst}
+    units at once.
+
+    {capacity} is either a number or the units of every capacity pool of
+    the table, see `write_capacities`: the slowest pool sets the pace and
+    writes are charged what they spent on it.
+
+    The rate is adaptive: it halves on every throttle and recovers
+    additively on success, never above the slowest pool. Throttled writes,
+    and those failed by a transient service or connection error, are
+    retried with full jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        capacity,
+        name="dynamodb",
+        metrics=None,
+        burst=None,
+        retries=8,
+        base_delay=0.05,
+        max_delay=5.0,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.metrics = metrics
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.burst = burst
+        self.bucket = TokenBucket(1, clock=clock)
+        self.resize(capacity)
+        self.bucket.tokens = self.bucket.burst
+
+    def resize(self, capacity):
+        """
+        Paces writes to a new {capacity}, as the table autoscales.
+        """
+        if not isinstance(capacity, dict):
+            capacity = {"table": capacity}
+        self.pools = capacity
+        self.capacity = min(capacity.values())
+        self.floor = self.capacity / 10
+        bucket = self.bucket
+        with bucket.lock:
+            bucket.refill()
+            bucket.rate = self.capacity
+            bucket.burst = self.burst or self.capacity
+            bucket.tokens = min(bucket.tokens, bucket.burst)
+
+    def __call__(self, write, units=1, wait=True, **kwargs):
+        """
+        Calls {write}(**kwargs) when {units} estimated capacity is available.
+
+        Without {wait} the units are spent right away, so paced writers
+        sharing the scheduler make up for them; only throttles are waited.
+        """
+        kwargs.setdefault("ReturnConsumedCapacity", "INDEXES")
+        for attempt in range(self.retries + 1):
+            delay = self.bucket.acquire(units)
+            if wait:
+                self.sleep(delay)
+            try:
+                response = write(**kwargs)
+            except ClientError as error:
+                code = error.response["Error"]["Code"]
+                retried = THROTTLE_ERRORS | TRANSIENT_ERRORS
+                if code not in retried or attempt == self.retries:
+                    raise
+                if code in THROTTLE_ERRORS:
+                    self.throttled(code)
+                else:
+                    self.emit("count", "retried", 1, code)
+                self.sleep(self.backoff(attempt))
+            except (ConnectionError, HTTPClientError) as error:
+                if attempt == self.retries:
+                    raise
+                self.emit("count", "retried", 1, type(error).__name__)
+                self.sleep(self.backoff(attempt))
+            else:
+                self.consumed(response, units)
+                return response
+
+    def pace(self):
+        """
+        Waits until the units spent without waiting are paid: writers that
+        fan out unpaced calls keep to the capacity between fan-outs.
+        """
+        self.sleep(self.bucket.acquire(0))
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, delay)
+
+    def throttled(self, code):
+        bucket = self.bucket
+        with bucket.lock:
+            bucket.rate = max(self.floor, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0)
+        self.emit("count", "throttled", 1, code)
+        self.emit("gauge", "write_rate", bucket.rate)
+
+    def consumed(self, response, units):
+        """
+        Reconciles the {units} estimate with the capacity the write spent on
+        the slowest pool, in units of that pool.
+        """
+        consumed = response.get("ConsumedCapacity") or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        used = 0
+        for item in consumed:
+            used += max(
+                [0] + [
+                    spent * self.capacity / self.pools[pool]
+                    for pool, spent in consumed_units(item).items()
+                    if self.pools.get(pool)
+                ]
+            )
+        if used:
+            self.bucket.adjust(used - units)
+        bucket = self.bucket
+        with bucket.lock:
+            bucket.rate = min(self.capacity, bucket.rate + self.floor / 10)
+
+    def emit(self, kind, metric, value, code=None):
+        if self.metrics is None:
+            return
+        tags = ["table:%s" % self.name]
+        if code:
+            tags.append("error:%s" % code)
+        getattr(self.metrics, kind)("bets.%s" % metric, value, tags=tags)
@@ -238,3 +238,13 @@ For Golf matches, you may have 3 players, so you also need to handle that.
 
 </dl>
 """
+
+
+@pytest.fixture(autouse=True)
+def fresh_tables():
+    """
+    Tables are created again under each test moto mock.
+    """
+    from chalicelib import controller
+    controller.BETS.table = controller.BETS.meta_table = None
+    yield
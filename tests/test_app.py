@@ -5,15 +5,28 @@ App interface tests cases
 """
 
 import json
+import time
 import urllib
 from decimal import Decimal
 from http import HTTPStatus
 
 import pytest
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError, EndpointConnectionError
 from chalice.local import ForbiddenError
 from moto import mock_dynamodb2
 
 from chalicelib import controller
+from chalicelib.archive import LocalArchive, partition
+from chalicelib.codec import (
+    decode_odds, encode_event, encode_odds, from_epoch, to_epoch,
+)
+from chalicelib.model import (
+    BET_TABLE_MAP, Bets, catalog, downsample, prefixes, selection_key,
+)
+from chalicelib.executor import gather
+from chalicelib.profiling import category
+from chalicelib.scheduler import WriteScheduler, write_capacities
 import app
 
 
@@ -56,6 +69,7 @@ class TestEndpoints:
             "GET /",
             "GET /match/{match_id}",
             "GET /matches",
+            "GET /sports",
             "POST /message",
             "POST /request",
             "PUT /message",
@@ -64,6 +78,31 @@ class TestEndpoints:
         for endpoint in expected_endpoints:
             assert endpoint in endpoints
 
+    def test__get_root__conditional_response(self, client):
+        response = client.get("/")
+        assert response.status_code == HTTPStatus.OK
+        etag = response.headers["ETag"]
+        assert "max-age" in response.headers["Cache-Control"]
+
+        response = client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        assert response.headers["ETag"] == etag
+
+        response = client.get("/", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == HTTPStatus.OK
+
+    def test__get_root__weak_etag(self, client):
+        # shared by the variants API Gateway compresses
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == HTTPStatus.OK
+        assert response.headers["ETag"].startswith('W/"')
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert "service" in response.json
+
+        etag = response.headers["ETag"]
+        response = client.get("/", headers={"If-None-Match": etag[2:]})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+
     def test__get_app__accepts_no_argument(self, client):
         response = client.get("/app")
         assert response.status_code == HTTPStatus.OK
@@ -134,7 +173,430 @@ class TestEndpoints:
         response = client.get("/matches?sport=football&ordering=startTime")
         assert response.status_code == HTTPStatus.OK
 
+    @mock_dynamodb2
+    def test__get_matches_by_selection(self, client, message):
+        response = client.put("/message", body=json.dumps(message),
+                              headers={"Content-Type": "application/json"})
+        assert response.status_code == HTTPStatus.OK
+        match_id = message["event"]["id"]
+
+        selections = ["real%20madrid", "Real%20Madrid", "8243901714083343527"]
+        for selection in selections:
+            response = client.get(f"/matches?selection={selection}")
+            assert response.status_code == HTTPStatus.OK
+            assert [match["id"] for match in response.json] == [match_id]
+
+        response = client.get("/matches?selection=Cavaliers")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == []
+
+        response = client.get("/matches?selection=Barcelona&sport=football")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @mock_dynamodb2
+    def test__get_matches_by_selection__retried_message(self, client, message,
+                                                         monkeypatch):
+        put_meta_batch = controller.BETS.put_meta_batch
+
+        def failed(requests):
+            monkeypatch.setattr(
+                controller.BETS, "put_meta_batch", put_meta_batch
+            )
+            raise ClientError({"Error": {"Code": "InternalServerError"}},
+                              "BatchWriteItem")
+
+        monkeypatch.setattr(controller.BETS, "put_meta_batch", failed)
+        with pytest.raises(ClientError):
+            controller.post_message(json.dumps(message))
+        response = client.get("/matches?selection=Barcelona")
+        assert response.json == []
+
+        response = client.post("/message", body=json.dumps(message))
+        assert response.status_code == HTTPStatus.OK
+        response = client.get("/matches?selection=Barcelona")
+        assert [match["id"] for match in response.json] == [
+            message["event"]["id"]
+        ]
+
+    @mock_dynamodb2
+    def test__get_odds_history(self, client, message):
+        match_id = message["event"]["id"]
+        response = client.get(f"/match/{match_id}/odds-history")
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+        for odds in [1.01, 2.5, 3.25]:
+            selection = message["event"]["markets"][0]["selections"][0]
+            selection["odds"] = odds
+            response = client.post("/message", body=json.dumps(message))
+            assert response.status_code == HTTPStatus.OK
+
+        response = client.get(f"/match/{match_id}/odds-history?resolution=3600")
+        assert response.status_code == HTTPStatus.OK
+        history = response.json
+        assert history["resolution"] == 3600
+        selections = {
+            item["id"]: item["odds"] for item in history["selections"]
+        }
+        assert len(selections) == 2
+        assert [odds for _, odds in selections[8243901714083343527]][-1] == 3.25
+
+        response = client.get(f"/match/{match_id}/odds-history?resolution=0")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        response = client.get(f"/match/{match_id}/odds-history?from=0&to=3600")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["selections"] == []
+        response = client.get(f"/match/{match_id}/odds-history?from=0")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @mock_dynamodb2
+    def test__process_stream__archives(self, client, message, tmp_path,
+                                       monkeypatch):
+        monkeypatch.setattr(controller.BETS, "archive", LocalArchive(tmp_path))
+        serializer = TypeSerializer()
+        event = dict(message["event"], _sport="Football", startTime=1529483400)
+        event = json.loads(json.dumps(event), parse_float=Decimal)
+        image = {
+            key: serializer.serialize(value) for key, value in event.items()
+        }
+        expired = {
+            "eventName": "REMOVE",
+            "userIdentity": {
+                "type": "Service",
+                "principalId": "dynamodb.amazonaws.com",
+            },
+            "dynamodb": {"OldImage": image},
+        }
+        deleted = dict(expired, userIdentity=None)
+
+        result = controller.process_stream([expired, deleted])
+        assert result["archived"] == 1
+        assert result["applied"] == 2
+        assert result["keys"][0].startswith("events/date=2018-06-20/")
+
+        query = "include_archived=1&selection=Barcelona"
+        dates = "archived_from=2018-06-20&archived_to=2018-06-21"
+        response = client.get(f"/matches?{query}&{dates}")
+        assert response.status_code == HTTPStatus.OK
+        assert [match["id"] for match in response.json] == [event["id"]]
+
+        dates = "archived_from=2018-06-21&archived_to=2018-06-30"
+        response = client.get(f"/matches?{query}&{dates}")
+        assert response.json == []
+        response = client.get(f"/matches?{query}")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+        response = client.get("/matches?selection=Barcelona")
+        assert response.json == []
+
+    @mock_dynamodb2
+    def test__process_stream__derives(self, client, message, monkeypatch):
+        monkeypatch.setattr(controller.BETS, "inline", False)
+        response = client.post("/message", body=json.dumps(message))
+        assert response.status_code == HTTPStatus.OK
+        response = client.get("/matches?selection=Barcelona")
+        assert response.json == []
+
+        serializer = TypeSerializer()
+        event = encode_event(dict(message["event"], _sport="football"))
+        image = {
+            key: serializer.serialize(value) for key, value in event.items()
+        }
+        inserted = {
+            "eventName": "INSERT",
+            "dynamodb": {"ApproximateCreationDateTime": 1529480000,
+                         "NewImage": image},
+        }
+        modified = {
+            "eventName": "MODIFY",
+            "dynamodb": {"ApproximateCreationDateTime": 1529480060,
+                         "NewImage": image, "OldImage": image},
+        }
+        result = controller.process_stream([inserted, modified])
+        assert result == {"archived": 0, "keys": [], "applied": 2}
+
+        response = client.get("/matches?selection=Barcelona")
+        assert [match["id"] for match in response.json] == [event["id"]]
+        match_id = event["id"]
+        window = "resolution=60&from=1529479000&to=1529481000"
+        response = client.get(f"/match/{match_id}/odds-history?{window}")
+        odds = response.json["selections"][0]["odds"]
+        assert odds == [[1529479980, 1.01], [1529480040, 1.01]]
+
+        removed = {"eventName": "REMOVE", "dynamodb": {"OldImage": image}}
+        for records in [[inserted], [inserted, modified]]:
+            controller.process_stream(records)  # replayed batches
+            response = client.get("/sports")
+            assert response.json[0]["unarchived_events"] == 1
+        for _ in range(2):
+            controller.process_stream([removed])
+            response = client.get("/sports")
+            assert response.json[0]["unarchived_events"] == 0
+
+    @mock_dynamodb2
+    def test__profile_requested(self, client, message):
+        response = client.get("/matches?sport=football&_profile=1")
+        assert response.status_code == HTTPStatus.OK
+        profile = response.json["profile"]
+        assert profile["route"] == "get_matches"
+        categories = {"boto3", "jsonschema", "serialization"}
+        assert set(profile["categories"]) >= categories
+        assert profile["top"]
+
+        response = client.put("/message?_profile=1", body=json.dumps(message),
+                              headers={"Content-Type": "application/json"})
+        gathered = {
+            call["function"]: call["calls"]
+            for call in response.json["profile"]["gathered"]
+        }
+        assert gathered["Bets.put_odds_sample"] == 2
+        assert gathered["Bets.put_meta_batch"] == 1
+
+        response = client.get("/matches?sport=football")
+        assert response.status_code == HTTPStatus.OK
+        assert isinstance(response.json, list)
+
+    @mock_dynamodb2
+    def test__get_suggestions(self, client, message):
+        response = client.get("/matches/suggest?q=re")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == []
+
+        response = client.post("/message", body=json.dumps(message))
+        assert response.status_code == HTTPStatus.OK
+
+        response = client.get("/matches/suggest?q=REAL%20ma")
+        assert response.status_code == HTTPStatus.OK
+        names = {item["name"] for item in response.json}
+        assert names == {"Real Madrid", "Real Madrid vs Barcelona"}
+
+        response = client.get("/matches/suggest?q=barc&limit=1")
+        assert len(response.json) == 1
+
+        response = client.get("/matches/suggest?q=%20")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        response = client.get("/matches/suggest?q=re&limit=0")
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    @mock_dynamodb2
+    def test__message__numeric_codec(self, client, message):
+        response = client.put("/message", body=json.dumps(message),
+                              headers={"Content-Type": "application/json"})
+        assert response.status_code == HTTPStatus.OK
+
+        response = client.get(f"/match/{message['event']['id']}")
+        assert response.status_code == HTTPStatus.OK
+        stored = json.loads(response.body, parse_float=Decimal)
+        selection = stored["markets"][0]["selections"][0]
+        assert selection["id"] == 8243901714083343527
+        assert selection["odds"] == Decimal("1.01")
+        assert stored["startTime"] == "2018-06-20 10:30:00"
+
+        message["event"]["markets"][0]["selections"][0]["odds"] = 1.3333
+        response = client.post("/message", body=json.dumps(message))
+        assert response.status_code == HTTPStatus.OK
+        response = client.get(f"/match/{message['event']['id']}")
+        stored = json.loads(response.body, parse_float=Decimal)
+        selection = stored["markets"][0]["selections"][0]
+        assert selection["odds"] == Decimal("1.3333")
+
+        message["event"]["startTime"] = "20/06/2018"
+        response = client.post("/message", body=json.dumps(message))
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    @mock_dynamodb2
+    def test__get_sports(self, client, message):
+        response = client.get("/sports")
+        assert response.status_code == HTTPStatus.OK
+
+        for match_id in [1, 1, 2]:
+            message["event"]["id"] = match_id
+            response = client.post("/message", body=json.dumps(message))
+            assert response.status_code == HTTPStatus.OK
+
+        response = client.get("/sports")
+        sports = {sport["name"]: sport for sport in response.json}
+        assert sports["Football"]["id"] == 221
+        assert sports["Football"]["unarchived_events"] == 2
+        markets = sports["Football"]["markets"]
+        assert markets == [{"name": "Winner", "unarchived_events": 2}]
+
+        for sport in ["football", "Football", "FOOTBALL"]:
+            response = client.get(f"/matches?sport={sport}")
+            assert sorted(match["id"] for match in response.json) == [1, 2]
+
+
+    @mock_dynamodb2
+    def test__get_sports__retried_message(self, client, message, monkeypatch):
+        count_event = controller.BETS.count_event
+
+        def throttled(match):
+            monkeypatch.setattr(controller.BETS, "count_event", count_event)
+            code = "ProvisionedThroughputExceededException"
+            raise ClientError({"Error": {"Code": code}}, "TransactWriteItems")
+
+        monkeypatch.setattr(controller.BETS, "count_event", throttled)
+        with pytest.raises(ClientError):
+            controller.post_message(json.dumps(message))
+
+        for _ in range(2):
+            response = client.post("/message", body=json.dumps(message))
+            assert response.status_code == HTTPStatus.OK
+            response = client.get("/sports")
+            assert response.json[0]["unarchived_events"] == 1
+
 
 class TestHelpers:
     def test__is_dev(self):
         assert app.is_dev()
+
+    def test__table_names(self, monkeypatch):
+        function = "api888-dev-archive_expired"
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", function)
+        bets = Bets()
+        assert bets.table_name == "betting-table-dev"
+        assert bets.meta_table_name == "betting-table-dev-meta"
+
+        monkeypatch.setenv("BETS_TABLE", "betting-table-prod")
+        assert Bets().meta_table_name == "betting-table-prod-meta"
+
+    def test__downsample(self):
+        items = [
+            {
+                "_sk": "000000003600#7",
+                "samples": ["0:1010000", "30:1500000", "90:2000000"],
+            },
+            {"_sk": "000000007200#7", "samples": ["10:2500000"]},
+        ]
+        series = downsample(items, 60)
+        assert series == [
+            {"id": 7, "odds": [[3600, 1.5], [3660, 2], [7200, 2.5]]},
+        ]
+        series = downsample(items, 60, start=3660, end=7200)
+        assert series == [{"id": 7, "odds": [[3660, 2]]}]
+
+    def test__write_scheduler__retries_throttled_writes(self):
+        sleeps = []
+        scheduler = WriteScheduler(4, sleep=sleeps.append, clock=lambda: 0)
+        calls = []
+
+        def write(**kwargs):
+            calls.append(kwargs)
+            if len(calls) < 3:
+                code = "ProvisionedThroughputExceededException"
+                raise ClientError({"Error": {"Code": code}}, "PutItem")
+            return {"ConsumedCapacity": {"CapacityUnits": 1}}
+
+        response = scheduler(write, Item={"id": 1})
+        assert response["ConsumedCapacity"]["CapacityUnits"] == 1
+        assert len(calls) == 3
+        assert calls[0]["ReturnConsumedCapacity"] == "INDEXES"
+        assert scheduler.bucket.rate < 4
+        assert all(delay >= 0 for delay in sleeps)
+
+        sleeps.clear()
+        for _ in range(8):
+            scheduler(lambda **kwargs: {}, wait=False)
+        assert sleeps == []
+        assert scheduler.bucket.tokens < 0
+        scheduler.pace()
+        assert sleeps[-1] == -scheduler.bucket.tokens / scheduler.bucket.rate
+
+        scheduler.resize({"table": 20, "index": 10})
+        assert scheduler.capacity == scheduler.bucket.rate == 10
+
+        def invalid(**kwargs):
+            error = {"Error": {"Code": "ValidationException"}}
+            raise ClientError(error, "PutItem")
+
+        with pytest.raises(ClientError):
+            scheduler(invalid)
+
+        failures = [
+            ClientError({"Error": {"Code": "InternalServerError"}}, "PutItem"),
+            EndpointConnectionError(endpoint_url="https://dynamodb"),
+        ]
+
+        def transient(**kwargs):
+            if failures:
+                raise failures.pop()
+            return {}
+
+        rate = scheduler.bucket.rate
+        assert scheduler(transient) == {}
+        assert failures == []
+        assert scheduler.bucket.rate >= rate  # not a throttle
+
+    def test__profiling_category(self):
+        assert category("/lib/site-packages/botocore/client.py", "f") == "boto3"
+        assert category("/lib/jsonschema/validators.py", "f") == "jsonschema"
+        assert category("~", "<built-in method Levenshtein.distance>") == (
+            "levenshtein"
+        )
+        assert category("/lib/json/encoder.py", "encode") == "serialization"
+        assert category("/src/app.py", "get_root") == "other"
+
+    def test__write_capacities(self):
+        capacities = write_capacities(BET_TABLE_MAP)
+        assert capacities == {"table": 5, "sport_startTime": 1}
+
+        scheduler = WriteScheduler(capacities, clock=lambda: 0)
+        assert scheduler.capacity == 1
+        tokens = scheduler.bucket.tokens
+        consumed = {
+            "CapacityUnits": 7,
+            "Table": {"CapacityUnits": 5},
+            "GlobalSecondaryIndexes": {"sport_startTime": {"CapacityUnits": 2}},
+        }
+        scheduler.consumed({"ConsumedCapacity": consumed}, units=1)
+        # 2 units spent on the index, 1 estimated
+        assert scheduler.bucket.tokens == tokens - 1
+
+    def test__prefixes(self):
+        assert prefixes("Real Madrid vs Barcelona") == {
+            "r", "re", "rea", "m", "ma", "mad", "v", "vs", "b", "ba", "bar",
+        }
+
+    def test__codec_odds(self):
+        for odds in [1.01, 5.55, 10.0, 2, 1.001, 1000.999, 1.3333, 1.0005]:
+            assert decode_odds(encode_odds(odds)) == odds
+        assert encode_odds(1.01) == 1010000
+        assert decode_odds(encode_odds(1 / 3)) == 0.333333
+
+    def test__codec_dates(self, monkeypatch):
+        monkeypatch.setenv("TZ", "America/New_York")
+        time.tzset()
+        try:
+            assert to_epoch("2018-06-20 10:30:00") == 1529490600
+            assert from_epoch(1529490600) == "2018-06-20 10:30:00"
+            assert partition({"startTime": 1529490600}) == "date=2018-06-20"
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+    def test__gather(self):
+        calls = [(pow, 2, 3), (pow, 3, 2), (str.upper, "a")]
+        assert gather(calls) == [8, 9, "A"]
+        assert gather([]) == []
+        with pytest.raises(ZeroDivisionError):
+            gather([(pow, 2, 3), (divmod, 1, 0)])
+
+    def test__catalog(self):
+        items = [
+            {"_sk": "market#golf#winner", "name": "Winner", "events": 3},
+            {"_sk": "sport#golf", "name": "Golf", "id": 7, "events": 3},
+            {"_sk": "sport#chess", "name": "Chess", "id": 8, "events": 0},
+        ]
+        assert catalog(items) == [
+            {
+                "name": "Golf", "id": 7, "unarchived_events": 3,
+                "markets": [{"name": "Winner", "unarchived_events": 3}],
+            },
+            {"name": "Chess", "id": 8, "unarchived_events": 0, "markets": []},
+        ]
+
+    def test__selection_key(self):
+        assert selection_key(" Real  MADRID ") == "selection#real madrid"
+        assert selection_key(8243901714083343527) == (
+            "selection_id#8243901714083343527"
+        )
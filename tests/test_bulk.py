@@ -0,0 +1,76 @@
+# flake8: noqa: B101
+
+"""
+Bulk export/import tool tests cases
+"""
+
+import boto3
+from moto import mock_dynamodb2
+
+from chalicelib.model import BET_TABLE_MAP
+import bulk
+
+
+@mock_dynamodb2
+def test__export_import__round_trip(tmp_path):
+    client = boto3.client("dynamodb")
+    table_map = {
+        key: value for key, value in BET_TABLE_MAP.items()
+        if key != "StreamSpecification"
+    }
+    for table in ("source", "target"):
+        client.create_table(TableName=table, **table_map)
+    items = [
+        {"id": {"N": str(uid)}, "name": {"S": "match %d" % uid}}
+        for uid in range(60)
+    ]
+    for item in items:
+        client.put_item(TableName="source", Item=item)
+
+    stale = tmp_path / "segment-0007.ndjson.gz"  # of a wider export
+    stale.write_bytes(b"")
+    manifest = bulk.export_table(
+        "source", str(tmp_path), segments=1, client=client  # moto ignores them
+    )
+    assert sum(manifest["files"].values()) == len(items)
+    assert not stale.exists()
+
+    count = bulk.import_table(
+        "target", str(tmp_path), capacity=1000, client=client
+    )
+    assert count == len(items)
+    stored = client.scan(TableName="target")["Items"]
+    assert sorted(stored, key=lambda item: int(item["id"]["N"])) == items
+
+    count = bulk.import_table(
+        "target", str(tmp_path), capacity=1000, client=client
+    )
+    assert count == 0
+
+
+@mock_dynamodb2
+def test__normalize__backfills_sport_keys():
+    client = boto3.client("dynamodb")
+    table_map = {
+        key: value for key, value in BET_TABLE_MAP.items()
+        if key != "StreamSpecification"
+    }
+    client.create_table(TableName="bets", **table_map)
+    for uid, sport in enumerate(["Football", " Tennis", "football"]):
+        client.put_item(TableName="bets", Item={
+            "id": {"N": str(uid)},
+            "sport": {"M": {"name": {"S": sport}}},
+            "_sport": {"S": sport},
+        })
+
+    count = bulk.normalize_table(
+        "bets", segments=1, capacity=1000, client=client
+    )
+    assert count == 2
+    stored = client.scan(TableName="bets")["Items"]
+    assert sorted(item["_sport"]["S"] for item in stored) == [
+        "football", "football", "tennis"
+    ]
+    assert bulk.normalize_table(
+        "bets", segments=1, capacity=1000, client=client
+    ) == 0